@@ -1,7 +1,9 @@
 from fastapi import FastAPI, BackgroundTasks, HTTPException
 from fastapi.responses import RedirectResponse, FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
+from contextlib import asynccontextmanager
+from typing import Optional
 import requests
 import os
 import json
@@ -9,6 +11,8 @@ import uuid
 import re
 import base64
 import unicodedata
+import threading
+import time
 from pydub import AudioSegment
 import logging
 from num2words import num2words
@@ -17,7 +21,14 @@ from num2words import num2words
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="Text-to-Speech API")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # El barrido inicial corre en el hilo del gestor, no bloquea el arranque
+    storage_manager.start()
+    yield
+    storage_manager.stop()
+
+app = FastAPI(title="Text-to-Speech API", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -31,6 +42,7 @@ class TextToSpeechRequest(BaseModel):
     text: str
     voice: str = "Xavier Hayasaka"
     lang: str = "es"
+    ttl_seconds: Optional[int] = Field(None, gt=0)
 
 class TextToSpeechResponse(BaseModel):
     audio_url: str
@@ -44,6 +56,26 @@ class TTSStreamRequest(BaseModel):
     add_wav_header: bool = True
     stream_chunk_size: str = "20"
 
+def read_int_env(name: str, default: int, minimum: int) -> int:
+    """
+    Lee un entero de una variable de entorno, aplicando un valor mínimo.
+
+    Los valores no numéricos usan el valor por defecto y los inferiores al
+    mínimo se ajustan a él; en ambos casos se registra un aviso.
+    """
+    raw = os.getenv(name)
+    if raw is None:
+        return default
+    try:
+        value = int(raw)
+    except ValueError:
+        logger.warning(f"{name}={raw!r} no es un entero válido, se usa {default}")
+        return default
+    if value < minimum:
+        logger.warning(f"{name}={value} es menor que {minimum}, se usa {minimum}")
+        return minimum
+    return value
+
 class Config:
     AUDIO_FILES_DIR = "audio_files"
     TEMP_DIR = "temp_audio"
@@ -51,6 +83,11 @@ class Config:
     SERVER_URL = os.getenv("SERVER_URL_VOICE_XTTS", "http://192.168.1.69:8820")
     SPEAKERS_JSON_PATH = 'studio_speakers.json'
     MAX_CHUNK_SIZE = 230
+    # Gestión del almacenamiento de audios generados
+    AUDIO_TTL_SECONDS = read_int_env("AUDIO_TTL_SECONDS", 24 * 3600, minimum=1)
+    AUDIO_MAX_BYTES = read_int_env("AUDIO_MAX_BYTES", 2 * 1024 ** 3, minimum=0)  # 0 = sin límite
+    CLEANUP_INTERVAL_SECONDS = read_int_env("CLEANUP_INTERVAL_SECONDS", 300, minimum=1)
+    PLACEHOLDER_FILES = {"empty"}
 
 # Crear directorios si no existen
 os.makedirs(Config.AUDIO_FILES_DIR, exist_ok=True)
@@ -59,6 +96,170 @@ os.makedirs(Config.AUDIO_TAGS_DIR, exist_ok=True)
 
 tasks_status = {}
 
+# Estados en los que un trabajo todavía puede escribir en disco
+ACTIVE_STATUSES = {"queued", "processing"}
+
+class StorageManager:
+    """
+    Mantiene acotado el uso de disco fuera del camino de las peticiones.
+
+    Un hilo en segundo plano ejecuta periódicamente (y al arrancar) un barrido que:
+    - elimina los fragmentos de TEMP_DIR cuyo trabajo ya no está activo
+      (trabajos fallidos o de ejecuciones anteriores),
+    - elimina los audios finales cuyo TTL ha vencido,
+    - expulsa los audios más antiguos mientras se supere AUDIO_MAX_BYTES.
+
+    Los trabajos afectados pasan a estado "expired" en tasks_status.
+    """
+
+    def __init__(self, audio_dir: str, temp_dir: str, ttl_seconds: int,
+                 max_bytes: int, interval_seconds: int):
+        self.audio_dir = audio_dir
+        self.temp_dir = temp_dir
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.interval_seconds = interval_seconds
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Arranca el hilo de limpieza; el primer barrido es inmediato."""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._run, name="storage-cleanup", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopping.set()
+        self._wakeup.set()
+        if self._thread:
+            self._thread.join(timeout=5)
+            self._thread = None
+
+    def request_sweep(self):
+        """Pide un barrido adelantado sin esperar a que termine."""
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                self.sweep()
+            except Exception as e:
+                logger.error(f"Error en la limpieza de almacenamiento: {str(e)}")
+            self._wakeup.wait(self.interval_seconds)
+            self._wakeup.clear()
+
+    def _list_files(self, directory: str):
+        """Devuelve (ruta, job_id, tamaño, mtime) de los archivos del directorio."""
+        files = []
+        try:
+            entries = list(os.scandir(directory))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.name in Config.PLACEHOLDER_FILES or not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            job_id = entry.name.split("_", 1)[0]
+            files.append((entry.path, job_id, stat.st_size, stat.st_mtime))
+        return files
+
+    def remove_file(self, path: str):
+        """Elimina un archivo ignorando que ya no exista; nunca lanza excepción."""
+        try:
+            os.remove(path)
+            return True
+        except FileNotFoundError:
+            return False
+        except OSError as e:
+            logger.warning(f"No se pudo eliminar {path}: {e}")
+            return False
+
+    def expire_job(self, job_id: str, reason: str):
+        """Marca como caducado un trabajo completado; los demás estados no se tocan."""
+        task = tasks_status.get(job_id)
+        if not task or task.get("status") != "completed":
+            return
+        # Se sustituye el diccionario entero para no modificarlo mientras se serializa
+        tasks_status[job_id] = {
+            **task,
+            "status": "expired",
+            "audio_url": None,
+            "output_file": None,
+            "expired_reason": reason,
+            "expired_at": int(time.time())
+        }
+
+    def sweep(self):
+        """Ejecuta un barrido completo de temporales, TTL y cuota."""
+        now = time.time()
+
+        # 0. Trabajos completados cuyo audio se borró por otros medios
+        for job_id, task in list(tasks_status.items()):
+            if task.get("status") != "completed":
+                continue
+            output_file = task.get("output_file")
+            if not output_file or not os.path.exists(output_file):
+                logger.warning(f"Audio del trabajo {job_id} no encontrado en disco")
+                self.expire_job(job_id, "missing")
+
+        # 1. Fragmentos huérfanos: su trabajo no está en curso
+        active_bytes = 0
+        for path, job_id, size, _ in self._list_files(self.temp_dir):
+            task = tasks_status.get(job_id)
+            if task and task["status"] in ACTIVE_STATUSES:
+                active_bytes += size
+                continue
+            if self.remove_file(path):
+                logger.info(f"Eliminado fragmento huérfano: {path}")
+
+        # 2. Audios finales con TTL vencido
+        remaining = []
+        for path, job_id, size, mtime in self._list_files(self.audio_dir):
+            task = tasks_status.get(job_id)
+            if task and task["status"] in ACTIVE_STATUSES:
+                # Todavía se está escribiendo; no cuenta para la expulsión
+                active_bytes += size
+                continue
+            if task and task["status"] != "completed":
+                # Restos de un trabajo fallido o ya caducado
+                if self.remove_file(path):
+                    logger.info(f"Eliminado audio huérfano: {path}")
+                continue
+            expires_at = task.get("expires_at") if task else None
+            if expires_at is None:
+                expires_at = mtime + self.ttl_seconds
+            if expires_at <= now:
+                if self.remove_file(path):
+                    logger.info(f"Audio caducado eliminado: {path}")
+                self.expire_job(job_id, "ttl")
+            else:
+                remaining.append((mtime, path, job_id, size))
+
+        # 3. Cuota global: expulsar los más antiguos primero
+        if self.max_bytes > 0:
+            total = active_bytes + sum(size for _, _, _, size in remaining)
+            for _, path, job_id, size in sorted(remaining):
+                if total <= self.max_bytes:
+                    break
+                if self.remove_file(path):
+                    logger.info(f"Audio expulsado por cuota: {path}")
+                self.expire_job(job_id, "quota")
+                total -= size
+
+storage_manager = StorageManager(
+    Config.AUDIO_FILES_DIR,
+    Config.TEMP_DIR,
+    Config.AUDIO_TTL_SECONDS,
+    Config.AUDIO_MAX_BYTES,
+    Config.CLEANUP_INTERVAL_SECONDS
+)
+
 def clean_spanish_text(text: str) -> str:
     """
     Limpia el texto eliminando emojis, iconos y caracteres especiales,
@@ -418,8 +619,9 @@ def merge_audio_elements(audio_files: list, output_filename: str):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error al unir archivos: {str(e)}")
 
-async def process_text_to_speech(text: str, voice: str, lang: str, job_id: str):
+async def process_text_to_speech(text: str, voice: str, lang: str, job_id: str, ttl_seconds: int = Config.AUDIO_TTL_SECONDS):
     """Procesa el texto dividiéndolo si es necesario y manejando las etiquetas."""
+    output_filename = f"{Config.AUDIO_FILES_DIR}/{job_id}_complete.mp3"
     try:
         tasks_status[job_id]["status"] = "processing"
         
@@ -467,24 +669,30 @@ async def process_text_to_speech(text: str, voice: str, lang: str, job_id: str):
         if not audio_files:
             raise Exception("No se generaron archivos de audio")
 
-        output_filename = f"{Config.AUDIO_FILES_DIR}/{job_id}_complete.mp3"
         merge_audio_elements(audio_files, output_filename)
         
+        # Limpiar archivos temporales (solo los generados, no los de etiquetas)
+        # antes de marcar el trabajo como completado, mientras sigue activo
+        for file in audio_files:
+            if file and file.startswith(Config.TEMP_DIR):
+                storage_manager.remove_file(file)
+        
         tasks_status[job_id].update({
             "status": "completed",
             "audio_url": f"/audio/{job_id}",
-            "output_file": output_filename
+            "output_file": output_filename,
+            "expires_at": int(time.time()) + ttl_seconds
         })
-        
-        # Limpiar archivos temporales (solo los generados, no los de etiquetas)
-        for file in audio_files:
-            if file and file.startswith(Config.TEMP_DIR) and os.path.exists(file):
-                os.remove(file)
                 
     except Exception as e:
         logger.error(f"Error en trabajo {job_id}: {str(e)}")
+        # La exportación puede dejar un archivo parcial aunque falle
+        storage_manager.remove_file(output_filename)
         tasks_status[job_id]["status"] = "failed"
         tasks_status[job_id]["error_message"] = str(e)
+    finally:
+        # Los fragmentos de trabajos fallidos y la cuota se resuelven en segundo plano
+        storage_manager.request_sweep()
 
 @app.get("/")
 async def read_root():
@@ -500,26 +708,31 @@ async def get_apidocs():
 
 @app.post("/text-to-speech", response_model=TextToSpeechResponse)
 async def text_to_speech(request: TextToSpeechRequest, background_tasks: BackgroundTasks):
+    ttl_seconds = request.ttl_seconds if request.ttl_seconds is not None else Config.AUDIO_TTL_SECONDS
     job_id = str(uuid.uuid4())
-    tasks_status[job_id] = {"status": "queued", "errors": [], "output_file": None, "audio_url": None}
-    background_tasks.add_task(process_text_to_speech, request.text, request.voice, request.lang, job_id)
+    tasks_status[job_id] = {"status": "queued", "errors": [], "output_file": None, "audio_url": None, "expires_at": None}
+    background_tasks.add_task(process_text_to_speech, request.text, request.voice, request.lang, job_id, ttl_seconds)
     return TextToSpeechResponse(job_id=job_id, status="queued", audio_url=f"/status/{job_id}")
 
 @app.get("/status/{job_id}", response_model=dict)
 def get_job_status(job_id: str):
     if job_id not in tasks_status:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
-    return tasks_status[job_id]
+    return dict(tasks_status[job_id])
 
 @app.get("/audio/{job_id}")
 async def get_audio(job_id: str):
     if job_id not in tasks_status:
         raise HTTPException(status_code=404, detail="Tarea no encontrada")
+    if tasks_status[job_id]["status"] == "expired":
+        raise HTTPException(status_code=410, detail="El audio ha caducado y ya no está disponible")
     if tasks_status[job_id]["status"] != "completed":
         raise HTTPException(status_code=400, detail=f"Audio aún no listo. Estado: {tasks_status[job_id]['status']}")
     output_file = tasks_status[job_id]["output_file"]
     if not output_file or not os.path.exists(output_file):
-        raise HTTPException(status_code=404, detail="Archivo no encontrado")
+        # Borrado fuera del gestor: reflejarlo en el estado
+        storage_manager.expire_job(job_id, "missing")
+        raise HTTPException(status_code=410, detail="El audio ha caducado y ya no está disponible")
     return FileResponse(path=output_file, media_type="audio/mpeg", filename=f"audio_{job_id}.mp3")
 
 def stream_audio_response(response_content: bytes, chunk_size: int = 8192):